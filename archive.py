@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from database import get_db_connection
+
+# Transactions older than this are moved out of SQLite into monthly column files
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_DIR = "archive"
+
+COLUMNS = ("id", "user_id", "symbol", "type", "quantity", "price", "timestamp")
+INT_COLUMNS = ("id", "user_id", "quantity")
+FLOAT_COLUMNS = ("price", "timestamp")
+
+# LRU of path -> (mtime, columns), so repeated history requests don't re-inflate files
+MAX_CACHED_PARTITIONS = 4
+_partition_cache = OrderedDict()
+# Request threads and the archiver share the cache; np.load happens outside the lock
+_partition_lock = threading.Lock()
+# (mtime, {user_id: [month, ...]}) for the user index file
+_index_cache = None
+
+def partition_path(month: str):
+    return os.path.join(ARCHIVE_DIR, f"transactions_{month}.npz")
+
+def index_path():
+    return os.path.join(ARCHIVE_DIR, "index.json")
+
+def list_partitions():
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(
+        os.path.join(ARCHIVE_DIR, name) for name in os.listdir(ARCHIVE_DIR)
+        if name.startswith("transactions_") and name.endswith(".npz")
+    )
+
+def read_partition(path: str):
+    """Returns one month of archived transactions as a dict of column arrays, sorted by user_id."""
+    mtime = os.path.getmtime(path)
+    with _partition_lock:
+        cached = _partition_cache.get(path)
+        if cached and cached[0] == mtime:
+            _partition_cache.move_to_end(path)
+            return cached[1]
+    with np.load(path, allow_pickle=False) as data:
+        columns = {name: data[name] for name in COLUMNS}
+    with _partition_lock:
+        _partition_cache[path] = (mtime, columns)
+        _partition_cache.move_to_end(path)
+        while len(_partition_cache) > MAX_CACHED_PARTITIONS:
+            _partition_cache.popitem(last=False)
+    return columns
+
+def _month_of(path: str):
+    return os.path.basename(path)[len("transactions_"):-len(".npz")]
+
+def _rebuild_index():
+    index = {}
+    for path in list_partitions():
+        with np.load(path, allow_pickle=False) as data:
+            user_ids = np.unique(data["user_id"])
+        for user_id in user_ids.tolist():
+            index.setdefault(str(user_id), []).append(_month_of(path))
+    _write_index(index)
+    return index
+
+def _write_index(index):
+    global _index_cache
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp_path = index_path() + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path())
+    _index_cache = None
+
+def load_index():
+    """Maps str(user_id) -> months that hold archived transactions for that user."""
+    global _index_cache
+    if not os.path.isdir(ARCHIVE_DIR):
+        return {}
+    if not os.path.exists(index_path()):
+        return _rebuild_index() if list_partitions() else {}
+    mtime = os.path.getmtime(index_path())
+    if _index_cache and _index_cache[0] == mtime:
+        return _index_cache[1]
+    with open(index_path()) as f:
+        index = json.load(f)
+    _index_cache = (mtime, index)
+    return index
+
+def _rows_to_columns(rows):
+    columns = {}
+    for name in COLUMNS:
+        values = [row[name] for row in rows]
+        if name in INT_COLUMNS:
+            columns[name] = np.array(values, dtype=np.int64)
+        elif name in FLOAT_COLUMNS:
+            columns[name] = np.array(values, dtype=np.float64)
+        else:
+            columns[name] = np.array(values, dtype=str)
+    return columns
+
+def _write_partition(path: str, columns):
+    if os.path.exists(path):
+        existing = read_partition(path)
+        # A previous run may have written this month but died before deleting
+        # the rows from SQLite, so drop ids that are already archived
+        fresh = ~np.isin(columns["id"], existing["id"])
+        columns = {name: np.concatenate([existing[name], columns[name][fresh]]) for name in COLUMNS}
+
+    # Sorted by user so a user's rows are one contiguous slice (see searchsorted below)
+    order = np.lexsort((columns["timestamp"], columns["user_id"]))
+    columns = {name: values[order] for name, values in columns.items()}
+
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **columns)
+    os.replace(tmp_path, path)
+    with _partition_lock:
+        _partition_cache.pop(path, None)
+
+def archive_transactions(older_than_days: int = ARCHIVE_AFTER_DAYS):
+    """Moves old transactions from SQLite into per-month .npz files. Returns the number moved."""
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).timestamp()
+    conn = get_db_connection()
+    try:
+        rows = conn.execute('SELECT * FROM transactions WHERE timestamp < ? ORDER BY timestamp', (cutoff,)).fetchall()
+        if not rows:
+            return 0
+
+        by_month = {}
+        for row in rows:
+            month = datetime.fromtimestamp(row['timestamp']).strftime("%Y-%m")
+            by_month.setdefault(month, []).append(row)
+
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        # Work on a copy: request threads may be iterating the cached index
+        index = {user_id: list(months) for user_id, months in load_index().items()}
+        for month, month_rows in by_month.items():
+            _write_partition(partition_path(month), _rows_to_columns(month_rows))
+            for user_id in {row['user_id'] for row in month_rows}:
+                months = index.setdefault(str(user_id), [])
+                if month not in months:
+                    months.append(month)
+                    months.sort()
+        _write_index(index)
+
+        # Only delete once every partition is safely on disk
+        max_id = max(row['id'] for row in rows)
+        conn.execute('DELETE FROM transactions WHERE timestamp < ? AND id <= ?', (cutoff, max_id))
+        conn.commit()
+        return len(rows)
+    finally:
+        conn.close()
+
+def load_archived_transactions(user_id: int):
+    """Returns a user's archived transactions as dicts shaped like the SQLite rows."""
+    results = []
+    for month in load_index().get(str(user_id), []):
+        path = partition_path(month)
+        if not os.path.exists(path):
+            continue
+        columns = read_partition(path)
+        start, end = np.searchsorted(columns["user_id"], [user_id, user_id + 1])
+        if start == end:
+            continue
+        picked = {name: columns[name][start:end].tolist() for name in COLUMNS}
+        for i in range(len(picked["id"])):
+            results.append({name: picked[name][i] for name in COLUMNS})
+    return results
+
+def get_user_transactions(user_id: int):
+    """Hot (SQLite) and cold (archive) transactions for a user, newest first."""
+    conn = get_db_connection()
+    hot = [dict(tx) for tx in conn.execute('SELECT * FROM transactions WHERE user_id=? ORDER BY timestamp DESC', (user_id,)).fetchall()]
+    conn.close()
+
+    hot_ids = {tx['id'] for tx in hot}
+    cold = [tx for tx in load_archived_transactions(user_id) if tx['id'] not in hot_ids]
+    if not cold:
+        return hot
+    return sorted(hot + cold, key=lambda tx: tx['timestamp'], reverse=True)
+
+if __name__ == "__main__":
+    moved = archive_transactions()
+    print(f"Archived {moved} transactions to {ARCHIVE_DIR}/")
@@ -0,0 +1,41 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = "static"
+COMPRESSIBLE = (".html", ".js", ".json", ".css", ".svg")
+
+def compress_file(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    written = []
+    with open(path + ".gz", "wb") as f:
+        # mtime=0 keeps the output byte-identical between builds
+        f.write(gzip.compress(raw, compresslevel=9, mtime=0))
+    written.append(path + ".gz")
+
+    if brotli is not None:
+        with open(path + ".br", "wb") as f:
+            f.write(brotli.compress(raw, quality=11))
+        written.append(path + ".br")
+    return written
+
+def build():
+    if brotli is None:
+        print("brotli not installed, only writing .gz files")
+
+    for name in sorted(os.listdir(STATIC_DIR)):
+        path = os.path.join(STATIC_DIR, name)
+        if not os.path.isfile(path) or not name.endswith(COMPRESSIBLE):
+            continue
+        original = os.path.getsize(path)
+        for out in compress_file(path):
+            print(f"{out}: {original} -> {os.path.getsize(out)} bytes")
+
+if __name__ == "__main__":
+    build()
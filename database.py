@@ -40,6 +40,8 @@ def init_db():
         timestamp REAL,
         FOREIGN KEY(user_id) REFERENCES users(id)
     )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)')
     
     # Watchlist
     c.execute('''CREATE TABLE IF NOT EXISTS watchlist (
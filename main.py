@@ -2,6 +2,10 @@ from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
@@ -10,18 +14,59 @@ import requests
 import sqlite3
 import asyncio
 import os
+import mimetypes
 import bcrypt
 import pandas as pd
 import numpy as np
 from jose import JWTError, jwt
 from database import get_db_connection
+from ratelimit import RateLimitMiddleware, TokenBucketLimiter
+from archive import archive_transactions, get_user_transactions
 
 # --- CONFIG ---
 SECRET_KEY = "supersecretkey123"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Each batch is one rate-limit token, so cap how many symbols it can make us price
+MAX_BATCH_ORDERS = 50
+
+# Rate limits per route group: (requests, seconds). Auth routes are limited per IP,
+# everything else per user from the JWT.
+RATE_LIMITS = {
+    "auth": (20, 60),
+    "search": (30, 10),
+    "market": (60, 10),
+    "trading": (20, 10),
+    "default": (60, 10),
+}
+RATE_LIMIT_GROUPS = (
+    ("/token", "auth"),
+    ("/register", "auth"),
+    ("/api/search", "search"),
+    ("/api/quote/", "market"),
+    ("/api/history/", "market"),
+    ("/api/news/", "market"),
+    ("/api/buy", "trading"),
+    ("/api/sell", "trading"),
+    ("/api/orders/", "trading"),
+    ("/api/limit-orders", "trading"),
+    ("/api/funds/", "trading"),
+    ("/api/", "default"),
+)
 
 app = FastAPI()
+rate_limiter = TokenBucketLimiter()
+
+# Added before CORS so CORS wraps the limiter and 429s still carry its headers
+app.add_middleware(
+    RateLimitMiddleware,
+    limits=RATE_LIMITS,
+    groups=RATE_LIMIT_GROUPS,
+    secret_key=SECRET_KEY,
+    algorithm=ALGORITHM,
+    ip_groups=("auth",),
+    limiter=rate_limiter,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +76,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON API responses (history can be large); precompressed static
+# files already carry Content-Encoding and are skipped by the middleware
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=6)
+
 # --- AUTH SECURITY ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -83,6 +132,17 @@ class LimitOrderRequest(BaseModel):
     target_price: float
     type: str # BUY or SELL
 
+class BatchOrder(BaseModel):
+    symbol: str
+    quantity: int
+    type: str # BUY or SELL
+    order_type: str = "MARKET" # MARKET or LIMIT
+    target_price: Optional[float] = None
+
+class BatchOrderRequest(BaseModel):
+    orders: List[BatchOrder]
+    all_or_nothing: bool = False
+
 class FundRequest(BaseModel):
     amount: float
 
@@ -102,6 +162,30 @@ def get_stock_price(symbol: str):
     except:
         return None
 
+def get_stock_prices(symbols: List[str]):
+    """Prices several symbols with one batched download, falling back per symbol."""
+    symbols = list(dict.fromkeys(symbols))
+    prices = {}
+    if not symbols:
+        return prices
+    try:
+        hist = yf.download(symbols, period="1d", progress=False, auto_adjust=False)
+        close = hist['Close']
+        if isinstance(close, pd.Series):
+            close = close.to_frame(symbols[0])
+        for symbol in symbols:
+            if symbol in close:
+                series = close[symbol].dropna()
+                if not series.empty:
+                    prices[symbol] = float(series.iloc[-1])
+    except Exception as e:
+        print(f"Batch Price Error: {e}")
+
+    for symbol in symbols:
+        if symbol not in prices:
+            prices[symbol] = get_stock_price(symbol)
+    return prices
+
 def get_stock_data_full(symbol: str):
     try:
         ticker = yf.Ticker(symbol)
@@ -168,9 +252,21 @@ async def check_limit_orders():
         
         await asyncio.sleep(60)
 
+async def archive_old_transactions():
+    while True:
+        try:
+            moved = await asyncio.to_thread(archive_transactions)
+            if moved:
+                print(f"Archived {moved} transactions")
+        except Exception as e:
+            print(f"Archive Error: {e}")
+
+        await asyncio.sleep(24 * 60 * 60)
+
 @app.on_event("startup")
 async def startup_event():
     asyncio.create_task(check_limit_orders())
+    asyncio.create_task(archive_old_transactions())
 
 # --- AUTH ENDPOINTS ---
 @app.post("/register")
@@ -434,12 +530,92 @@ def sell_stock(trade: TradeRequest, user = Depends(get_current_user)):
     conn.close()
     return {"message": f"Sold {trade.quantity} of {trade.symbol}"}
 
+@app.post("/api/orders/batch")
+def batch_orders(req: BatchOrderRequest, user = Depends(get_current_user)):
+    if not req.orders: raise HTTPException(status_code=400, detail="No orders")
+    if len(req.orders) > MAX_BATCH_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ORDERS} orders per batch")
+
+    results = []
+    for i, order in enumerate(req.orders):
+        order.type = order.type.upper()
+        order.order_type = order.order_type.upper()
+        result = {"index": i, "symbol": order.symbol, "type": order.type, "order_type": order.order_type,
+                  "quantity": order.quantity, "price": None, "status": "PENDING", "detail": None}
+        if order.quantity <= 0:
+            result.update(status="REJECTED", detail="Invalid quantity")
+        elif order.type not in ("BUY", "SELL"):
+            result.update(status="REJECTED", detail="Type must be BUY or SELL")
+        elif order.order_type not in ("MARKET", "LIMIT"):
+            result.update(status="REJECTED", detail="Order type must be MARKET or LIMIT")
+        elif order.order_type == "LIMIT" and (order.target_price is None or order.target_price <= 0):
+            result.update(status="REJECTED", detail="Invalid target price")
+        results.append(result)
+
+    if req.all_or_nothing and any(r['status'] == "REJECTED" for r in results):
+        raise HTTPException(status_code=400, detail=results)
+
+    prices = get_stock_prices([r['symbol'] for r in results if r['status'] != "REJECTED"])
+
+    conn = get_db_connection()
+    try:
+        # Lock the DB before reading cash so concurrent requests can't overspend it
+        conn.execute('BEGIN IMMEDIATE')
+        cash = conn.execute('SELECT cash FROM users WHERE id = ?', (user['id'],)).fetchone()['cash']
+
+        fills = []
+        # Sells first so their proceeds can fund the buys of a rebalance
+        for result in sorted(results, key=lambda r: r['type'] != "SELL"):
+            if result['status'] == "REJECTED":
+                continue
+            order = req.orders[result['index']]
+            price = prices.get(order.symbol)
+            if not price:
+                result.update(status="REJECTED", detail="Stock not found")
+                continue
+            result['price'] = price
+
+            if order.order_type == "LIMIT":
+                hit = price <= order.target_price if order.type == "BUY" else price >= order.target_price
+                if not hit:
+                    result['status'] = "QUEUED"
+                    continue
+
+            cost = price * order.quantity
+            if order.type == "BUY":
+                if cash < cost:
+                    result.update(status="REJECTED", detail="Insufficient funds")
+                    continue
+                cash -= cost
+            else:
+                cash += cost
+            result['status'] = "EXECUTED"
+            fills.append((order, price))
+
+        if req.all_or_nothing and any(r['status'] == "REJECTED" for r in results):
+            conn.rollback()
+            raise HTTPException(status_code=400, detail=results)
+
+        now = datetime.now().timestamp()
+        conn.execute('UPDATE users SET cash = ? WHERE id = ?', (cash, user['id']))
+        conn.executemany(
+            'INSERT INTO portfolio (user_id, symbol, quantity) VALUES (?, ?, ?) '
+            'ON CONFLICT(user_id, symbol) DO UPDATE SET quantity = quantity + excluded.quantity',
+            [(user['id'], order.symbol, order.quantity if order.type == "BUY" else -order.quantity) for order, _ in fills])
+        conn.execute('DELETE FROM portfolio WHERE user_id = ? AND quantity = 0', (user['id'],))
+        conn.executemany('INSERT INTO transactions (user_id, symbol, type, quantity, price, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+                         [(user['id'], order.symbol, order.type, order.quantity, price, now) for order, price in fills])
+        conn.executemany('INSERT INTO limit_orders (user_id, symbol, target_price, quantity, type, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                         [(user['id'], r['symbol'], req.orders[r['index']].target_price, r['quantity'], r['type'], now)
+                          for r in results if r['status'] == "QUEUED"])
+        conn.commit()
+    finally:
+        conn.close()
+    return {"cash": cash, "results": results}
+
 @app.get("/api/transactions")
 def get_transactions(user = Depends(get_current_user)):
-    conn = get_db_connection()
-    txs = conn.execute('SELECT * FROM transactions WHERE user_id=? ORDER BY timestamp DESC', (user['id'],)).fetchall()
-    conn.close()
-    return [dict(tx) for tx in txs]
+    return get_user_transactions(user['id'])
 
 @app.post("/api/limit-orders")
 def create_limit_order(order: LimitOrderRequest, user = Depends(get_current_user)):
@@ -497,7 +673,70 @@ def remove_watchlist(symbol: str, user = Depends(get_current_user)):
     conn.close()
     return {"message": "Removed"}
 
+# --- STATIC FILES ---
+# HTML and the service worker are not fingerprinted, so browsers must revalidate
+# them (cheap 304 via ETag). Everything else can be cached for a day.
+REVALIDATE_FILES = (".html", "sw.js")
+STATIC_MAX_AGE = 86400
+
+def parse_accept_encoding(header: str):
+    """Returns the encodings the client accepts (q > 0) from an Accept-Encoding header."""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    return accepted
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Serves .br/.gz siblings written by build_static.py when the client accepts them."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        accepted = parse_accept_encoding(request_headers.get("accept-encoding", ""))
+        path = str(full_path)
+        media_type = mimetypes.guess_type(path)[0] or "text/plain"
+
+        response = None
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding not in accepted:
+                continue
+            try:
+                compressed_stat = os.stat(path + suffix)
+            except OSError:
+                continue
+            # Ignore stale builds left behind after the source was edited
+            if compressed_stat.st_mtime < stat_result.st_mtime:
+                continue
+            response = FileResponse(path + suffix, status_code=status_code, stat_result=compressed_stat,
+                                    media_type=media_type, headers={"Content-Encoding": encoding})
+            break
+
+        if response is None:
+            response = FileResponse(path, status_code=status_code, stat_result=stat_result)
+
+        response.headers["Vary"] = "Accept-Encoding"
+        if path.endswith(REVALIDATE_FILES):
+            response.headers["Cache-Control"] = "no-cache"
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}"
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
 # Serve static
 if not os.path.exists("static"):
     os.makedirs("static")
-app.mount("/", StaticFiles(directory="static", html=True), name="static")
\ No newline at end of file
+app.mount("/", PrecompressedStaticFiles(directory="static", html=True), name="static")
\ No newline at end of file
@@ -0,0 +1,120 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from fastapi.responses import JSONResponse
+from jose import JWTError, jwt
+
+SHARDS = 16
+# Past this size a shard evicts its least recently used buckets once they have
+# refilled completely (idle clients). Buckets still refilling are never dropped.
+MAX_BUCKETS_PER_SHARD = 10000
+
+class TokenBucketLimiter:
+    """Token buckets spread over independently locked shards to keep contention low."""
+
+    def __init__(self, shards: int = SHARDS):
+        self._shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+
+    def clear(self):
+        for buckets, lock in self._shards:
+            with lock:
+                buckets.clear()
+
+    def acquire(self, key, capacity: float, refill_rate: float, now: float = None):
+        """Takes one token for key. Returns 0 if allowed, else seconds until a token is free."""
+        if now is None:
+            now = time.monotonic()
+        buckets, lock = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                self._evict_idle(buckets, now)
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+                buckets.move_to_end(key)
+
+            if tokens >= 1:
+                buckets[key] = (tokens - 1, now, capacity, refill_rate)
+                return 0.0
+            buckets[key] = (tokens, now, capacity, refill_rate)
+            return (1 - tokens) / refill_rate
+
+    @staticmethod
+    def _evict_idle(buckets, now):
+        # Only looks at the LRU end and stops at the first active bucket, so each
+        # bucket is examined about once when evicted: amortized O(1) per new key
+        while len(buckets) >= MAX_BUCKETS_PER_SHARD:
+            key, (tokens, last, capacity, refill_rate) = next(iter(buckets.items()))
+            if tokens + (now - last) * refill_rate < capacity:
+                break
+            del buckets[key]
+
+@lru_cache(maxsize=4096)
+def _decode_token(token: str, secret_key: str, algorithm: str):
+    try:
+        payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+    except JWTError:
+        return None, 0
+    return payload.get("sub"), payload.get("exp", 0)
+
+class RateLimitMiddleware:
+    """
+    Limits requests per route group. limits maps group -> (requests, seconds);
+    groups is a sequence of (path prefix, group), first match wins. Groups in
+    ip_groups are keyed by client IP, the rest by the JWT user (or IP without one).
+    """
+
+    def __init__(self, app, limits, groups, secret_key, algorithm, ip_groups=(), limiter=None):
+        self.app = app
+        self.limits = limits
+        self.groups = groups
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.ip_groups = ip_groups
+        self.limiter = limiter or TokenBucketLimiter()
+
+    def group_for(self, path: str):
+        for prefix, group in self.groups:
+            if path.startswith(prefix):
+                return group
+        return None
+
+    def identify(self, scope, group):
+        if group not in self.ip_groups:
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    scheme, _, token = value.decode("latin-1").partition(" ")
+                    if scheme.lower() == "bearer" and token:
+                        username, exp = _decode_token(token, self.secret_key, self.algorithm)
+                        # Cached decodes can outlive the token, so recheck expiry
+                        if username and exp > time.time():
+                            return "user:" + username
+                    break
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        group = self.group_for(scope["path"])
+        if group is None or group not in self.limits:
+            await self.app(scope, receive, send)
+            return
+
+        requests, seconds = self.limits[group]
+        retry_after = self.limiter.acquire((group, self.identify(scope, group)), requests, requests / seconds)
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Too many requests"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
@@ -1,17 +1,86 @@
+const SHELL_CACHE = 'virtual-trading-shell-v2';
+const DATA_CACHE = 'virtual-trading-data-v2';
+// Oldest history responses are evicted past this many entries
+const MAX_DATA_ENTRIES = 40;
+// Intraday candles from the last session would be misleading, so only these are cached
+const CACHEABLE_INTERVALS = ['1d', '5d', '1wk', '1mo', '3mo'];
+
+const SHELL_ASSETS = [
+  '/index.html',
+  '/login.html',
+  '/manifest.json',
+  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+  'https://cdn.jsdelivr.net/npm/apexcharts'
+];
+
 self.addEventListener('install', (e) => {
   e.waitUntil(
-    caches.open('virtual-trading-store').then((cache) => cache.addAll([
-      '/index.html',
-      '/login.html',
-      'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
-      'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
-      'https://cdn.jsdelivr.net/npm/chart.js'
-    ]))
+    caches.open(SHELL_CACHE)
+      .then((cache) => cache.addAll(SHELL_ASSETS))
+      .then(() => self.skipWaiting())
   );
 });
 
-self.addEventListener('fetch', (e) => {
-  e.respondWith(
-    caches.match(e.request).then((response) => response || fetch(e.request))
+// Drop caches from older versions of this worker
+self.addEventListener('activate', (e) => {
+  const keep = [SHELL_CACHE, DATA_CACHE];
+  e.waitUntil(
+    caches.keys()
+      .then((keys) => Promise.all(keys.filter((k) => !keep.includes(k)).map((k) => caches.delete(k))))
+      .then(() => self.clients.claim())
+  );
+});
+
+function trimCache(cache, maxEntries) {
+  return cache.keys().then((keys) =>
+    Promise.all(keys.slice(0, Math.max(keys.length - maxEntries, 0)).map((k) => cache.delete(k)))
+  );
+}
+
+// Answer from cache immediately and refresh the cached copy in the background
+function staleWhileRevalidate(request, cacheName, maxEntries) {
+  return caches.open(cacheName).then((cache) =>
+    cache.match(request).then((cached) => {
+      const network = fetch(request).then((response) => {
+        if (response.ok) {
+          const copy = response.clone();
+          // Delete first so the refreshed entry moves to the end of the key order
+          cache.delete(request)
+            .then(() => cache.put(request, copy))
+            .then(() => maxEntries && trimCache(cache, maxEntries));
+        }
+        return response;
+      });
+      if (cached) {
+        network.catch(() => {});
+        return cached;
+      }
+      return network;
+    })
   );
-});
\ No newline at end of file
+}
+
+self.addEventListener('fetch', (e) => {
+  const request = e.request;
+  if (request.method !== 'GET') return;
+
+  const url = new URL(request.url);
+
+  // Daily and longer candles are the same for every user and change slowly
+  if (url.origin === location.origin && url.pathname.startsWith('/api/history/')) {
+    if (CACHEABLE_INTERVALS.includes(url.searchParams.get('interval') || '1d')) {
+      e.respondWith(staleWhileRevalidate(request, DATA_CACHE, MAX_DATA_ENTRIES));
+    }
+    return;
+  }
+
+  // Everything else under /api and auth is live data: always go to the network
+  if (url.origin === location.origin && (url.pathname.startsWith('/api/') || url.pathname === '/token')) {
+    return;
+  }
+
+  if (request.mode === 'navigate' || SHELL_ASSETS.includes(url.pathname) || SHELL_ASSETS.includes(request.url)) {
+    e.respondWith(staleWhileRevalidate(request, SHELL_CACHE));
+  }
+});
@@ -1,8 +1,18 @@
 from fastapi.testclient import TestClient
-from main import app
+from main import app, rate_limiter, create_access_token, RATE_LIMITS, RATE_LIMIT_GROUPS, SECRET_KEY, ALGORITHM
 from database import get_db_connection, init_db
+from ratelimit import TokenBucketLimiter, RateLimitMiddleware
+from datetime import timedelta
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+import archive
+import numpy as np
 import unittest
 import os
+import sys
+import gzip
+import tempfile
+import time
 
 client = TestClient(app)
 
@@ -12,6 +22,8 @@ class TestTradingPlatform(unittest.TestCase):
         init_db()
 
     def setUp(self):
+        # Every test registers from the same "testclient" IP; don't let them share auth limits
+        rate_limiter.clear()
         self.username = f"testuser_{os.urandom(4).hex()}"
         self.password = "testpass"
         client.post("/register", json={"username": self.username, "password": self.password})
@@ -42,5 +54,257 @@ class TestTradingPlatform(unittest.TestCase):
             self.assertIn("sma", first_candle)
             self.assertIn("rsi", first_candle)
 
+    def test_batch_orders_all_or_nothing(self):
+        orders = [
+            {"symbol": "TCS.NS", "quantity": 1, "type": "BUY"},
+            {"symbol": "INFY.NS", "quantity": 0, "type": "BUY"},
+        ]
+        response = client.post("/api/orders/batch", json={"orders": orders, "all_or_nothing": True}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        results = response.json()["detail"]
+        self.assertEqual(results[1]["status"], "REJECTED")
+
+        # Nothing was applied
+        me = client.get("/api/me", headers=self.headers).json()
+        self.assertEqual(me["cash"], 100000.0)
+        self.assertEqual(client.get("/api/transactions", headers=self.headers).json(), [])
+
+    def test_batch_orders_execute_in_one_transaction(self):
+        prices = {"AAA.NS": 900.0, "BBB.NS": 1000.0, "CCC.NS": 500.0}
+        with patch("main.get_stock_prices", lambda symbols: {s: prices[s] for s in symbols}):
+            response = client.post("/api/orders/batch", json={"orders": [
+                {"symbol": "AAA.NS", "quantity": 100, "type": "BUY"},
+            ]}, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["cash"], 10000.0)
+
+            # Buying BBB needs the proceeds of selling AAA listed after it
+            response = client.post("/api/orders/batch", json={"orders": [
+                {"symbol": "BBB.NS", "quantity": 50, "type": "BUY"},
+                {"symbol": "AAA.NS", "quantity": 100, "type": "SELL"},
+                {"symbol": "CCC.NS", "quantity": 10, "type": "BUY", "order_type": "LIMIT", "target_price": 400},
+            ]}, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertEqual([r["status"] for r in body["results"]], ["EXECUTED", "EXECUTED", "QUEUED"])
+            self.assertEqual(body["cash"], 50000.0)
+
+            # All-or-nothing: the second buy can't be funded, so nothing is written
+            response = client.post("/api/orders/batch", json={"all_or_nothing": True, "orders": [
+                {"symbol": "CCC.NS", "quantity": 10, "type": "BUY"},
+                {"symbol": "BBB.NS", "quantity": 100, "type": "BUY"},
+                {"symbol": "CCC.NS", "quantity": 5, "type": "SELL", "order_type": "LIMIT", "target_price": 600},
+            ]}, headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["detail"][1]["detail"], "Insufficient funds")
+
+        self.assertEqual(client.get("/api/me", headers=self.headers).json()["cash"], 50000.0)
+        conn = get_db_connection()
+        user_id = conn.execute('SELECT id FROM users WHERE username = ?', (self.username,)).fetchone()['id']
+        portfolio = conn.execute('SELECT symbol, quantity FROM portfolio WHERE user_id = ?', (user_id,)).fetchall()
+        txs = conn.execute('SELECT symbol, type, quantity, price FROM transactions WHERE user_id = ? ORDER BY id', (user_id,)).fetchall()
+        limits = conn.execute('SELECT symbol, type, quantity, target_price, status FROM limit_orders WHERE user_id = ?', (user_id,)).fetchall()
+        conn.close()
+        self.assertEqual([tuple(r) for r in portfolio], [("BBB.NS", 50)])
+        self.assertEqual([tuple(r) for r in txs], [("AAA.NS", "BUY", 100, 900.0), ("AAA.NS", "SELL", 100, 900.0), ("BBB.NS", "BUY", 50, 1000.0)])
+        self.assertEqual([tuple(r) for r in limits], [("CCC.NS", "BUY", 10, 400.0, "PENDING")])
+
+    def test_batch_orders_size_cap(self):
+        orders = [{"symbol": "TCS.NS", "quantity": 1, "type": "BUY"}] * 51
+        response = client.post("/api/orders/batch", json={"orders": orders}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_archive_transactions(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("database.DB_NAME", os.path.join(tmp, "test.db")), \
+                patch("archive.ARCHIVE_DIR", os.path.join(tmp, "archive")):
+            init_db()
+            client.post("/register", json={"username": self.username, "password": self.password})
+            token = client.post("/token", data={"username": self.username, "password": self.password}).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            conn = get_db_connection()
+            user_id = conn.execute('SELECT id FROM users WHERE username = ?', (self.username,)).fetchone()['id']
+            now = time.time()
+            for days in (1, 100, 130, 200):
+                conn.execute('INSERT INTO transactions (user_id, symbol, type, quantity, price, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+                             (user_id, "TCS.NS", "BUY", days, 3500.5, now - days * 86400))
+            # Another user's old row shares the partition
+            conn.execute('INSERT INTO transactions (user_id, symbol, type, quantity, price, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+                         (user_id + 1, "INFY.NS", "SELL", 1, 1500.0, now - 100 * 86400))
+            conn.commit()
+
+            self.assertEqual(archive.archive_transactions(90), 4)
+            self.assertEqual(len(conn.execute('SELECT * FROM transactions').fetchall()), 1)
+            self.assertTrue(archive.list_partitions())
+
+            txs = client.get("/api/transactions", headers=headers).json()
+            self.assertEqual([tx['quantity'] for tx in txs], [1, 100, 130, 200])
+            hot, cold = txs[0], txs[1]
+            self.assertEqual(list(hot.keys()), list(cold.keys()))
+            self.assertEqual([type(v) for v in hot.values()], [type(v) for v in cold.values()])
+
+            # Simulate a run that wrote its partition but died before deleting from SQLite
+            old = txs[1]
+            conn.execute('INSERT INTO transactions (id, user_id, symbol, type, quantity, price, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         tuple(old[k] for k in archive.COLUMNS))
+            conn.commit()
+            self.assertEqual(len(client.get("/api/transactions", headers=headers).json()), 4)
+            archive.archive_transactions(90)
+            conn.close()
+
+            ids = np.concatenate([archive.read_partition(p)["id"] for p in archive.list_partitions()])
+            self.assertEqual(len(ids), len(np.unique(ids)))
+            self.assertEqual(len(ids), 4)
+            self.assertEqual([tx['id'] for tx in client.get("/api/transactions", headers=headers).json()],
+                             [tx['id'] for tx in txs])
+
+    def test_archive_concurrent_reads(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("archive.ARCHIVE_DIR", tmp), \
+                patch("archive.MAX_CACHED_PARTITIONS", 4):
+            paths = []
+            for month in range(1, 9):
+                path = archive.partition_path(f"2020-{month:02d}")
+                archive._write_partition(path, archive._rows_to_columns([
+                    {"id": month * 10 + i, "user_id": i, "symbol": "TCS.NS", "type": "BUY",
+                     "quantity": 1, "price": 100.0, "timestamp": float(month * 1000 + i)}
+                    for i in range(3)
+                ]))
+                paths.append(path)
+
+            def read_all(offset):
+                for i in range(1000):
+                    columns = archive.read_partition(paths[(i + offset) % len(paths)])
+                    self.assertEqual(len(columns["id"]), 3)
+
+            # 8 partitions through a 4-entry LRU forces constant eviction across threads;
+            # a tiny switch interval makes them interleave inside read_partition
+            interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+            try:
+                with ThreadPoolExecutor(max_workers=16) as pool:
+                    for future in [pool.submit(read_all, n) for n in range(16)]:
+                        future.result()
+            finally:
+                sys.setswitchinterval(interval)
+
+    def test_token_bucket_limiter(self):
+        limiter = TokenBucketLimiter()
+        key = ("search", "user:" + self.username)
+        # Burst of 3, refilling one token per second
+        for _ in range(3):
+            self.assertEqual(limiter.acquire(key, 3, 1.0, now=100.0), 0)
+        self.assertAlmostEqual(limiter.acquire(key, 3, 1.0, now=100.0), 1.0)
+        self.assertEqual(limiter.acquire(key, 3, 1.0, now=101.0), 0)
+        # Other users have their own bucket
+        self.assertEqual(limiter.acquire(("search", "user:other"), 3, 1.0, now=100.0), 0)
+
+    def test_token_bucket_eviction_uses_each_buckets_limits(self):
+        limiter = TokenBucketLimiter(shards=1)
+        auth_key = ("auth", "ip:1.2.3.4")
+        with patch("ratelimit.MAX_BUCKETS_PER_SHARD", 2):
+            for _ in range(20):
+                limiter.acquire(auth_key, 20, 20 / 60, now=0.0)
+            self.assertGreater(limiter.acquire(auth_key, 20, 20 / 60, now=0.0), 0)
+            # New keys with faster search limits must not evict the drained auth bucket
+            limiter.acquire(("search", "user:a"), 30, 3.0, now=10.0)
+            limiter.acquire(("search", "user:b"), 30, 3.0, now=10.0)
+            # 10s at 20/min refills ~3 tokens, not a fresh burst of 20
+            for _ in range(3):
+                self.assertEqual(limiter.acquire(auth_key, 20, 20 / 60, now=10.0), 0)
+            self.assertGreater(limiter.acquire(auth_key, 20, 20 / 60, now=10.0), 0)
+
+    def test_rate_limit_route_groups(self):
+        middleware = RateLimitMiddleware(None, RATE_LIMITS, RATE_LIMIT_GROUPS, SECRET_KEY, ALGORITHM, ip_groups=("auth",))
+        self.assertEqual(middleware.group_for("/token"), "auth")
+        self.assertEqual(middleware.group_for("/register"), "auth")
+        self.assertEqual(middleware.group_for("/api/search"), "search")
+        self.assertEqual(middleware.group_for("/api/history/TCS.NS"), "market")
+        self.assertEqual(middleware.group_for("/api/orders/batch"), "trading")
+        self.assertEqual(middleware.group_for("/api/limit-orders/3"), "trading")
+        self.assertEqual(middleware.group_for("/api/me"), "default")
+        self.assertIsNone(middleware.group_for("/index.html"))
+
+        def scope(token):
+            return {"headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("1.2.3.4", 5000)}
+        self.assertEqual(middleware.identify(scope(self.token), "default"), "user:" + self.username)
+        self.assertEqual(middleware.identify(scope(self.token), "auth"), "ip:1.2.3.4")
+        self.assertEqual(middleware.identify(scope("garbage"), "default"), "ip:1.2.3.4")
+        expired = create_access_token({"sub": self.username}, expires_delta=timedelta(minutes=-1))
+        self.assertEqual(middleware.identify(scope(expired), "default"), "ip:1.2.3.4")
+
+    def test_rate_limit_middleware(self):
+        other = f"testuser_{os.urandom(4).hex()}"
+        client.post("/register", json={"username": other, "password": self.password})
+        other_token = client.post("/token", data={"username": other, "password": self.password}).json()["access_token"]
+        rate_limiter.clear()
+
+        with patch.dict(RATE_LIMITS, {"default": (2, 60), "auth": (2, 60)}):
+            for _ in range(2):
+                self.assertEqual(client.get("/api/me", headers=self.headers).status_code, 200)
+            response = client.get("/api/me", headers=self.headers)
+            self.assertEqual(response.status_code, 429)
+            self.assertGreaterEqual(int(response.headers["retry-after"]), 1)
+
+            # Buckets are per user
+            self.assertEqual(client.get("/api/me", headers={"Authorization": f"Bearer {other_token}"}).status_code, 200)
+
+            # Invalid tokens fall back to the IP bucket
+            bad = {"Authorization": "Bearer garbage"}
+            self.assertEqual(client.get("/api/me", headers=bad).status_code, 401)
+            self.assertEqual(client.get("/api/me", headers=bad).status_code, 401)
+            self.assertEqual(client.get("/api/me", headers=bad).status_code, 429)
+
+            # /token and /register share one bucket per IP, whoever logs in
+            self.assertEqual(client.post("/token", data={"username": self.username, "password": "wrong"}).status_code, 400)
+            self.assertEqual(client.post("/token", data={"username": other, "password": "wrong"}).status_code, 400)
+            response = client.post("/register", json={"username": f"testuser_{os.urandom(4).hex()}", "password": "x"})
+            self.assertEqual(response.status_code, 429)
+            self.assertIn("retry-after", response.headers)
+
+    def test_static_cache_headers(self):
+        response = client.get("/index.html")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["cache-control"], "no-cache")
+        self.assertIn("etag", response.headers)
+
+        # Revalidating with the ETag should be a cheap 304
+        cached = client.get("/index.html", headers={"If-None-Match": response.headers["etag"]})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_static_precompressed(self):
+        path = os.path.join("static", f"_test_{os.urandom(4).hex()}.js")
+        # Below GZipMiddleware's minimum_size so only the precompressed file can be encoded
+        body = b"console.log('precompressed');" * 20
+        try:
+            with open(path, "wb") as f:
+                f.write(body)
+            with open(path + ".gz", "wb") as f:
+                f.write(gzip.compress(body))
+            st = os.stat(path)
+            os.utime(path + ".gz", (st.st_atime, st.st_mtime + 10))
+            url = "/" + os.path.basename(path)
+
+            response = client.get(url, headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(response.headers["content-encoding"], "gzip")
+            self.assertEqual(response.headers["vary"], "Accept-Encoding")
+            self.assertEqual(response.content, body)
+
+            # q=0 means the client refuses that encoding
+            response = client.get(url, headers={"Accept-Encoding": "gzip;q=0"})
+            self.assertNotIn("content-encoding", response.headers)
+            self.assertEqual(response.content, body)
+
+            # A .gz older than its source is stale and must be skipped
+            os.utime(path, (st.st_atime, st.st_mtime + 20))
+            response = client.get(url, headers={"Accept-Encoding": "gzip"})
+            self.assertNotIn("content-encoding", response.headers)
+            self.assertEqual(response.content, body)
+        finally:
+            for p in (path, path + ".gz"):
+                if os.path.exists(p):
+                    os.remove(p)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file